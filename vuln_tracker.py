@@ -1,34 +1,145 @@
+import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sqlite3
 import json
+import hashlib
+import ijson
+import re
 from datetime import datetime, timezone, timedelta
-from dateutil.parser import parse
-from packaging.version import parse as parse_version
-from packaging.specifiers import SpecifierSet
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import os
 from typing import Optional, List, Tuple
 
+# Prefer orjson for its much faster parsing and serialization, fall back to the standard library
+try:
+    import orjson
+
+    def json_dumps(obj, sort_keys: bool = False) -> str:
+        """Serialize obj to compact JSON text"""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj, sort_keys: bool = False) -> str:
+        """Serialize obj to compact JSON text, formatted like orjson does"""
+        return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False)
+
+    json_loads = json.loads
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
+
+# Maximum number of queries OSV accepts in a single /v1/querybatch request
+OSV_BATCH_SIZE = 1000
+
+# Days before a cached OSV response is considered stale and queried again
+OSV_CACHE_TTL_DAYS = 7
+
+# Concurrent OSV requests, bounded by the session's connection pool size
+OSV_MAX_WORKERS = 16
+
+# Longest lastModStartDate to lastModEndDate range NIST accepts in a single query
+NIST_DATE_RANGE = timedelta(days=120)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Initialize a rate limiter refilling rate tokens per second, holding at most capacity"""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens: float = 1):
+        """Block until the given number of tokens is available, then consume them"""
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                time.sleep((tokens - self.tokens) / self.rate)
 
 class VulnerabilityTracker:
-    def __init__(self, db_path: str = "vulnerabilities.db", api_key: Optional[str] = None):
-        """Initialize the vulnerability tracker with database path and optional API key"""
+    # Terms that indicate it's not a Java package
+    EXCLUDE_TERMS = {
+        'javascript', 'node', 'npm', 'nodejs', 'typescript',
+        'react', 'vue', 'angular', 'webpack', 'babel',
+        'eslint', 'prettier', 'yarn', 'deno'
+    }
+
+    JAVA_TERMS = {
+        'java', 'jdk', 'jre', 'spring', 'hibernate', 'tomcat', 'maven',
+        'gradle', 'jakarta', 'javax', 'jetty', 'jdbc', 'jpa', 'jms',
+        'groovy', 'kotlin', 'scala'
+    }
+
+    # Each term set as a single alternation, so a string is scanned once instead of once per term.
+    # Unanchored on purpose: terms match anywhere, e.g. "spring" in "spring_framework"
+    _exclude_re = re.compile('|'.join(map(re.escape, sorted(EXCLUDE_TERMS, key=len, reverse=True))))
+    _java_re = re.compile('|'.join(map(re.escape, sorted(JAVA_TERMS, key=len, reverse=True))))
+
+    def __init__(self, db_path: str = "vulnerabilities.db", api_key: Optional[str] = None,
+                 refresh_cache: bool = False):
+        """Initialize the vulnerability tracker with database path, optional API key and
+        whether to ignore the OSV cache TTL"""
         self.db_path = db_path
         self.api_key = api_key
-        self.sleep_time = 6.1 
+        self.refresh_cache = refresh_cache
+        self.session = self.create_session()
+        # NIST allows 5 requests in a rolling 30 second window, 50 with an API key. Refill over
+        # 30.5 seconds to leave a margin for request jitter, and no bursts, since a full bucket
+        # on top of the refill could exceed the window
+        self.nist_rate_limiter = TokenBucket(rate=(50 if api_key else 5) / 30.5, capacity=1)
+        self._tz = timezone(timedelta(hours=3))
+        self._java_package_names = set()
         self.start_date = "2023-01-01T00:00:00+03:00"
         self.end_date = "2024-12-31T23:59:59+03:00"
         self.init_database()
 
+    def create_session(self) -> requests.Session:
+        """Create an HTTP session reusing connections and retrying rate-limited or failed requests"""
+        retry = Retry(
+            total=5,
+            backoff_factor=1.0,
+            # NIST answers rate-limited requests with 403
+            status_forcelist=[403, 429, 500, 502, 503, 504],
+            # OSV queries are POSTs but don't modify anything, so they are safe to retry
+            allowed_methods=["GET", "POST"],
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OSV_MAX_WORKERS, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        return session
+
     def init_database(self):
-        """Initialize the database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Initialize the database connection and required tables"""
+        # Long-lived connection in autocommit mode, transactions are opened explicitly
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+
+        # WAL with synchronous=NORMAL only syncs on checkpoints instead of every commit,
+        # the rest keeps temp tables and more of the database pages in memory
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-65536')   # 64 MiB
+        self.conn.execute('PRAGMA mmap_size=268435456')  # 256 MiB
+
+        with self.transaction() as conn:
             cursor = conn.cursor()
             
             # Create metadata table
@@ -39,16 +150,74 @@ class VulnerabilityTracker:
                 )
             ''')
             
-            # Create new vulnerabilities table
+            # Create package tables, one row per package, version and distinct range
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS vulnerabilities (
-                    package_name TEXT PRIMARY KEY,
-                    vulnerable_versions TEXT NOT NULL,  -- JSON array of versions
-                    osv_ranges TEXT,                    -- JSON array of range objects
+                CREATE TABLE IF NOT EXISTS package (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS package_version (
+                    package_id INTEGER NOT NULL REFERENCES package(id),
+                    version TEXT NOT NULL,
+                    PRIMARY KEY (package_id, version)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS osv_range (
+                    package_id INTEGER NOT NULL REFERENCES package(id),
+                    range_hash BLOB NOT NULL,           -- SHA-1 digest of the canonical JSON range
+                    range TEXT NOT NULL,                -- JSON range object
+                    PRIMARY KEY (package_id, range_hash)
+                ) WITHOUT ROWID
+            ''')
+
+            # Packages without ranges are found by probing the osv_range primary key on package_id,
+            # this index serves incremental re-scans of recently updated packages
+            cursor.execute('CREATE INDEX IF NOT EXISTS ix_package_updated ON package(updated_at)')
+
+            # Move data of the old JSON blob vulnerabilities table into the package tables
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = 'vulnerabilities'")
+            result = cursor.fetchone()
+            if result and result[0] == 'table':
+                self.migrate_vulnerabilities_table(cursor)
+
+            # Range hashes used to be hex text, convert them to the 20-byte digests used now
+            cursor.execute('SELECT typeof(range_hash) FROM osv_range LIMIT 1')
+            result = cursor.fetchone()
+            if result and result[0] == 'text':
+                cursor.execute('SELECT package_id, range_hash FROM osv_range')
+                cursor.executemany('UPDATE osv_range SET range_hash = ? WHERE package_id = ? AND range_hash = ?',
+                                   [(bytes.fromhex(range_hash), package_id, range_hash)
+                                    for package_id, range_hash in cursor.fetchall()])
+
+            # Keep the old vulnerabilities shape available for reading
+            cursor.execute('''
+                CREATE VIEW IF NOT EXISTS vulnerabilities AS
+                SELECT
+                    p.name AS package_name,
+                    (SELECT json_group_array(version) FROM package_version
+                     WHERE package_id = p.id) AS vulnerable_versions,
+                    (SELECT CASE WHEN count(*) > 0 THEN json_group_array(json(range)) END FROM osv_range
+                     WHERE package_id = p.id) AS osv_ranges,
+                    p.created_at,
+                    p.updated_at
+                FROM package p
+            ''')
+
+            # Create OSV response cache table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS osv_cache (
+                    package TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    ranges TEXT,                        -- JSON array of range objects, NULL if none
+                    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (package, version)
+                )
+            ''')
             
             # Initialize metadata if not exists
             cursor.execute('SELECT value FROM metadata WHERE key = "lastModEndDate"')
@@ -57,23 +226,94 @@ class VulnerabilityTracker:
                 cursor.execute('INSERT INTO metadata (key, value) VALUES (?, ?)',
                              ("lastModEndDate", self.start_date))
             
-            conn.commit()
-            
+    def migrate_vulnerabilities_table(self, cursor: sqlite3.Cursor):
+        """Copy packages, versions and ranges of the old vulnerabilities table, which kept
+        versions and ranges as JSON blobs, into the package tables and drop it"""
+        logger.info("Migrating vulnerabilities table to package tables...")
+
+        cursor.execute('''
+            INSERT OR IGNORE INTO package (name, created_at, updated_at)
+            SELECT package_name, created_at, updated_at FROM vulnerabilities
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO package_version (package_id, version)
+            SELECT p.id, v.value
+            FROM vulnerabilities, json_each(vulnerable_versions) v
+            JOIN package p ON p.name = package_name
+        ''')
+
+        cursor.execute('''
+            SELECT p.id, r.value
+            FROM vulnerabilities, json_each(osv_ranges) r
+            JOIN package p ON p.name = package_name
+            WHERE osv_ranges IS NOT NULL
+        ''')
+        ranges = [
+            (package_id, *self.canonical_range(json_loads(range_json)))
+            for package_id, range_json in cursor.fetchall()
+        ]
+        cursor.executemany('INSERT OR IGNORE INTO osv_range (package_id, range_hash, range) VALUES (?, ?, ?)',
+                           ranges)
+
+        cursor.execute('DROP TABLE vulnerabilities')
+
+    @staticmethod
+    def canonical_range(range_obj: dict) -> Tuple[bytes, str]:
+        """Return (hash, JSON) of a range, serialized canonically so equal ranges get the same hash"""
+        range_json = json_dumps(range_obj, sort_keys=True)
+        return hashlib.sha1(range_json.encode()).digest(), range_json
+
+    @contextmanager
+    def transaction(self):
+        """Run the writes of the block in a single transaction, joining one already in progress"""
+        if self.conn.in_transaction:
+            yield self.conn
+            return
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def close(self):
+        """Close the database connection and HTTP session"""
+        # Let SQLite refresh query planner statistics for the indexes if needed
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
+        self.session.close()
+
     def get_last_mod_end_date(self) -> str:
         """Get the last modification end date from metadata"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT value FROM metadata WHERE key = "lastModEndDate"')
-            result = cursor.fetchone()
-            return result[0] if result else self.start_date
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT value FROM metadata WHERE key = "lastModEndDate"')
+        result = cursor.fetchone()
+        return result[0] if result else self.start_date
             
     def update_last_mod_end_date(self, end_date: str):
         """Update the last modification end date in metadata"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute('UPDATE metadata SET value = ? WHERE key = "lastModEndDate"',
                          (end_date,))
-            conn.commit()
+
+    def get_start_index_checkpoint(self, range_start: str) -> int:
+        """Get the startIndex to resume a date range from, 0 unless it was interrupted midway"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT key, value FROM metadata WHERE key IN ("currentRangeStart", "currentStartIndex")')
+        checkpoint = dict(cursor.fetchall())
+        if checkpoint.get("currentRangeStart") != range_start:
+            return 0
+        return int(checkpoint.get("currentStartIndex", 0))
+
+    def update_start_index_checkpoint(self, range_start: str, start_index: int):
+        """Update the date range being fetched and the startIndex of its next page in metadata"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)',
+                               [("currentRangeStart", range_start), ("currentStartIndex", str(start_index))])
 
     def get_date_ranges(self, start_date: str, end_date: str) -> List[Tuple[str, str]]:
         """Break down date range into 120-day chunks because of the range filter limit"""
@@ -82,14 +322,13 @@ class VulnerabilityTracker:
         
         ranges = []
         current = start
+        # Format with +03:00 timezone as it worked in curl, each boundary only once
+        current_str = current.astimezone(self._tz).isoformat(timespec='milliseconds')
         while current < end:
-            range_end = min(current + timedelta(days=120), end)
-            # Format with +03:00 timezone as it worked in curl
-            ranges.append((
-                current.strftime("%Y-%m-%dT%H:%M:%S.000+03:00"),
-                range_end.strftime("%Y-%m-%dT%H:%M:%S.000+03:00")
-            ))
-            current = range_end
+            range_end = min(current + NIST_DATE_RANGE, end)
+            range_end_str = range_end.astimezone(self._tz).isoformat(timespec='milliseconds')
+            ranges.append((current_str, range_end_str))
+            current, current_str = range_end, range_end_str
         
         return ranges
             
@@ -98,108 +337,258 @@ class VulnerabilityTracker:
       
         cpe = package.get('cpe', {})
 
-        cpe_name = cpe.get('cpeName', '').lower()
+        # Most CPEs aren't applications, reject them before any string work
+        cpe_name = cpe.get('cpeName', '')
+        if not cpe_name.startswith('cpe:2.3:a:'):
+            return False, "", ""
 
-        # parse cpe name
-        cpe_details = cpe_name.split(':')
+        # parse cpe name, only up to the version field
+        cpe_details = cpe_name.lower().split(':', 6)
 
-        if cpe_details[2] != 'a':
-            return False, "", ""
-        
         package_name = cpe_details[4]
         package_version = cpe_details[5]
 
-        # Terms that indicate it's not a Java package
-        exclude_terms = {
-            'javascript', 'node', 'npm', 'nodejs', 'typescript',
-            'react', 'vue', 'angular', 'webpack', 'babel',
-            'eslint', 'prettier', 'yarn', 'deno'
-        }
+        # Other versions of an already matched package are Java too, and stored under the same name
+        if package_name in self._java_package_names:
+            return True, package_name, package_version
 
-        java_terms = {
-            'java', 'jdk', 'jre', 'spring', 'hibernate', 'tomcat', 'maven',
-            'gradle', 'jakarta', 'javax', 'jetty', 'jdbc', 'jpa', 'jms',
-            'groovy', 'kotlin', 'scala'
-        }
+        # Exclude terms (node, npm, ...) are far more common in CPE names than Java terms,
+        # so a name containing one is rejected before any Java term work
+        if self._exclude_re.search(package_name):
+            return False, "", ""
 
         # check if package name string contains any of the java terms
-        if any(term in package_name for term in java_terms) and not any(term in package_name for term in exclude_terms):
+        if self._java_re.search(package_name):
+            self._java_package_names.add(package_name)
             return True, package_name, package_version
 
         # Check product name
         product = cpe.get('product', {}).get('name', '').lower()
-        if any(term in product for term in java_terms) and not any(term in product for term in exclude_terms):
+        if self._java_re.search(product) and not self._exclude_re.search(product):
+            self._java_package_names.add(package_name)
             return True, package_name, package_version
             
         # Check titles
         titles = cpe.get('titles', [])
         title_text = ' '.join(t.get('title', '').lower() for t in titles)
-        if any(term in title_text for term in java_terms) and not any(term in title_text for term in exclude_terms):
+        if self._java_re.search(title_text) and not self._exclude_re.search(title_text):
+            self._java_package_names.add(package_name)
             return True, package_name, package_version
             
         return False, "", ""
             
-    def try_get_osv_ranges(self, package_name: str, version: str) -> list:
-        """Try to get vulnerability ranges from OSV for a given package and version.
-        
+    def get_cached_osv_ranges(self, pairs: List[Tuple[str, str]]) -> dict:
+        """Get cached OSV ranges for package/version pairs fetched within the cache TTL.
+
+        Pairs cached without ranges are returned as an empty list, so packages unknown to
+        OSV are not queried again until the TTL expires.
+
         Args:
-            package_name: Name of the package
-            version: Version of the package
-            
+            pairs: List of (package_name, version) tuples
+
         Returns:
-            List of ranges from OSV response. Empty list if no ranges found or error occurs.
+            Dict mapping (package_name, version) to its list of ranges, for cached pairs only.
         """
-        osv_url = "https://api.osv.dev/v1/query"
-        osv_payload = {
-            "package": {
-                "name": package_name,
-            },
-            "version": version
-        }
-        
+        if self.refresh_cache:
+            return {}
+
+        cached = {}
+        for package_name, version in pairs:
+            result = self.conn.execute('''
+                SELECT ranges FROM osv_cache
+                WHERE package = ? AND version = ? AND fetched_at >= datetime('now', ?)
+            ''', (package_name, version, f"-{OSV_CACHE_TTL_DAYS} days")).fetchone()
+            if result:
+                cached[(package_name, version)] = json_loads(result[0]) if result[0] else []
+
+        return cached
+
+    def cache_osv_ranges(self, ranges_by_pair: dict):
+        """Store OSV ranges per (package_name, version) in the cache, NULL for no ranges"""
+        with self.transaction() as conn:
+            for (package_name, version), ranges in ranges_by_pair.items():
+                conn.execute('''
+                    INSERT OR REPLACE INTO osv_cache (package, version, ranges, fetched_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (package_name, version, json_dumps(ranges) if ranges else None))
+
+    def get_osv_vuln_ranges(self, vuln_id: str) -> Optional[list]:
+        """Get the ranges of every affected entry of a single OSV vulnerability.
+
+        Args:
+            vuln_id: OSV vulnerability ID (e.g. GHSA-xxxx-xxxx-xxxx)
+
+        Returns:
+            List of ranges from the vulnerability, empty if it has none. None if an error occurs.
+        """
+        vuln_url = f"https://api.osv.dev/v1/vulns/{vuln_id}"
+
         try:
-            osv_response = requests.post(osv_url, json=osv_payload)
-            osv_response.raise_for_status()
-            osv_data = osv_response.json()
-            
+            vuln_response = self.session.get(vuln_url)
+            vuln_response.raise_for_status()
+            vuln = json_loads(vuln_response.content)
+
             all_ranges = []
-            for vuln in osv_data.get('vulns', []):
-                for affected in vuln.get('affected', []):
-                    ranges = affected.get('ranges', [])
-                    if ranges:
-                        all_ranges.extend(ranges)
-            
+            for affected in vuln.get('affected', []):
+                ranges = affected.get('ranges', [])
+                if ranges:
+                    all_ranges.extend(ranges)
+
             return all_ranges
-            
-        except requests.RequestException as e:
-            logging.error(f"Error querying OSV: {str(e)}")
-            return []
-            
+
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error fetching OSV vulnerability {vuln_id}: {str(e)}")
+            return None
+
+    def get_osv_batch_vuln_ids(self, pairs: List[Tuple[str, str]]) -> List[Optional[List[str]]]:
+        """Query the OSV querybatch endpoint for up to OSV_BATCH_SIZE package/version pairs.
+
+        Args:
+            pairs: List of (package_name, version) tuples
+
+        Returns:
+            List of vulnerability IDs per pair, in the same order as pairs. None for every
+            pair if an error occurs.
+        """
+        batch_url = "https://api.osv.dev/v1/querybatch"
+        batch_payload = {
+            "queries": [
+                {"package": {"name": package_name}, "version": version}
+                for package_name, version in pairs
+            ]
+        }
+
+        try:
+            batch_response = self.session.post(batch_url, json=batch_payload)
+            batch_response.raise_for_status()
+            results = json_loads(batch_response.content).get('results', [])
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error querying OSV batch: {str(e)}")
+            return [None] * len(pairs)
+
+        pair_vuln_ids = []
+        for i in range(len(pairs)):
+            vulns = results[i].get('vulns', []) if i < len(results) else []
+            pair_vuln_ids.append([vuln['id'] for vuln in vulns])
+
+        return pair_vuln_ids
+
+    def try_get_osv_ranges_batch(self, pairs: List[Tuple[str, str]]) -> List[list]:
+        """Try to get vulnerability ranges from OSV for many package/version pairs at once.
+
+        Pairs found in the cache are not queried. The querybatch endpoint only returns
+        vulnerability IDs, so each distinct vulnerability is fetched once afterwards to
+        collect its ranges. Requests run concurrently on a thread pool, while cache
+        reads and writes stay on the calling thread. Only complete lookups are cached.
+
+        Args:
+            pairs: List of (package_name, version) tuples
+
+        Returns:
+            List of ranges per pair, in the same order as pairs. Empty list for a pair
+            if no ranges found or error occurs.
+        """
+        cached = self.get_cached_osv_ranges(pairs)
+        missing = [pair for pair in dict.fromkeys(pairs) if pair not in cached]
+        chunks = [missing[i:i + OSV_BATCH_SIZE] for i in range(0, len(missing), OSV_BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=OSV_MAX_WORKERS) as executor:
+            pair_vuln_ids = [
+                vuln_ids
+                for chunk_vuln_ids in executor.map(self.get_osv_batch_vuln_ids, chunks)
+                for vuln_ids in chunk_vuln_ids
+            ]
+
+            # Several versions usually share the same vulnerabilities, fetch each only once
+            unique_vuln_ids = list(dict.fromkeys(
+                vuln_id for vuln_ids in pair_vuln_ids for vuln_id in vuln_ids or []
+            ))
+            vuln_ranges = dict(zip(unique_vuln_ids, executor.map(self.get_osv_vuln_ranges, unique_vuln_ids)))
+
+        # Skip caching pairs whose lookup failed, so they are retried on the next run
+        fetched = {}
+        for pair, vuln_ids in zip(missing, pair_vuln_ids):
+            if vuln_ids is None or any(vuln_ranges[vuln_id] is None for vuln_id in vuln_ids):
+                continue
+            fetched[pair] = [range_obj for vuln_id in vuln_ids for range_obj in vuln_ranges[vuln_id]]
+
+        if fetched:
+            self.cache_osv_ranges(fetched)
+        cached.update(fetched)
+
+        return [cached.get(pair, []) for pair in pairs]
+
+    def store_osv_ranges(self, pairs: List[Tuple[str, str]], new_packages: bool = False) -> int:
+        """Query OSV for the given package/version pairs and store any ranges found.
+
+        Args:
+            pairs: List of (package_name, version) tuples
+            new_packages: Whether the pairs aren't stored yet, so pairs without ranges are
+                stored too. Each pair is then written once, together with its ranges.
+
+        Returns:
+            Number of pairs for which ranges were found.
+        """
+        ranges_found = 0
+        vulnerabilities = []
+        for (package_name, version), ranges in zip(pairs, self.try_get_osv_ranges_batch(pairs)):
+            if ranges:
+                ranges_found += 1
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Found OSV ranges for %s %s: %s", package_name, version, json_dumps(ranges))
+            if ranges or new_packages:
+                vulnerabilities.append((package_name, version, ranges or None))
+
+        self.store_vulnerabilities(vulnerabilities)
+
+        return ranges_found
+
     def fetch_missing_osv_ranges(self):
         """Process packages that don't have OSV ranges"""
-        logging.info("Processing packages without OSV ranges...")
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT package_name, vulnerable_versions FROM vulnerabilities WHERE osv_ranges IS NULL')
-            packages = cursor.fetchall()
-            
-            processed_count = 0
-            ranges_found = 0
-            
-            for package_name, versions in packages:
-                versions = json.loads(versions)
-                for version in versions:
-                    processed_count += 1
-                    print(f"\nTrying to get OSV ranges for {package_name} {version}")
-                    ranges = self.try_get_osv_ranges(package_name, version)
-                    if ranges:
-                        ranges_found += 1
-                        print(f"\nFound OSV ranges for {package_name} {version}")
-                        print(json.dumps(ranges, indent=2))
-                        self.store_vulnerability(package_name, version, ranges)
-            
-            logging.info(f"Processed {processed_count} packages, found ranges for {ranges_found}")
+        logger.info("Processing packages without OSV ranges...")
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT p.name, v.version
+            FROM package p
+            JOIN package_version v ON v.package_id = p.id
+            WHERE NOT EXISTS (SELECT 1 FROM osv_range r WHERE r.package_id = p.id)
+        ''')
+        pairs = cursor.fetchall()
+
+        logger.info(f"Trying to get OSV ranges for {len(pairs)} package versions")
+
+        ranges_found = self.store_osv_ranges(pairs)
+
+        logger.info(f"Processed {len(pairs)} packages, found ranges for {ranges_found}")
             
+    def iter_nist_products(self, response: requests.Response, page: dict):
+        """Yield the products of a streamed NIST CPE response while it downloads.
+
+        Only one product is held in memory at a time instead of the whole page. The
+        top-level counters (totalResults, resultsPerPage) are stored in page as they
+        are parsed.
+        """
+        events = ijson.sendable_list()
+        parser = ijson.parse_coro(events, use_float=True)
+        builder = None
+
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            parser.send(chunk)
+            for prefix, event, value in events:
+                if prefix in ('totalResults', 'resultsPerPage'):
+                    page[prefix] = value
+                elif prefix == 'products.item' and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                elif builder is not None:
+                    builder.event(event, value)
+                    if prefix == 'products.item' and event == 'end_map':
+                        yield builder.value
+                        builder = None
+            del events[:]
+
+        parser.close()
+
     def fetch_nist_feed(self) -> Optional[dict]:
         """Fetch CPE data from NIST NVD for 2023-2024 period, filtering for Java packages"""
         base_url = "https://services.nvd.nist.gov/rest/json/cpes/2.0"
@@ -210,19 +599,22 @@ class VulnerabilityTracker:
 
         processed_count = 0
         java_count = 0
+        osv_pairs = []
         
         # Get the last processed date from metadata
         start_date = self.get_last_mod_end_date()
         
         # If we've reached the end date, only process packages without OSV ranges
         if start_date >= self.end_date:
-            logging.info("Up to date with end date, processing missing OSV ranges...")
+            logger.info("Up to date with end date, processing missing OSV ranges...")
             return self.fetch_missing_osv_ranges()
             
         date_ranges = self.get_date_ranges(start_date, self.end_date)
         
         for start_range, end_range in date_ranges:
-            start_index = 0
+            start_index = self.get_start_index_checkpoint(start_range)
+            if start_index:
+                logger.info(f"Resuming date range {start_range} to {end_range} from startIndex={start_index}")
             while True:
                 params = {
                     "startIndex": start_index,
@@ -231,125 +623,113 @@ class VulnerabilityTracker:
                 }
                 
                 try:
-                    logging.info(f"Fetching CPEs (startIndex={start_index}, dateRange={start_range} to {end_range})")
-                    request_start_time = time.time()
-                    response = requests.get(base_url, params=params, headers=headers)
-                    
-                    if response.status_code == 403:
-                        logging.error("Rate limit exceeded. Waiting 30 seconds before retry...")
-                        time.sleep(30)
-                        continue
-                        
-                    response.raise_for_status()
-                    data = response.json()
-                    
-                    products = data.get('products', [])
-                    if not products:
+                    self.nist_rate_limiter.take()
+                    logger.info(f"Fetching CPEs (startIndex={start_index}, dateRange={start_range} to {end_range})")
+                    page = {}
+                    page_count = 0
+                    with self.session.get(base_url, params=params, headers=headers, stream=True) as response:
+                        response.raise_for_status()
+
+                        # Process each package as soon as it is parsed, committing once per page
+                        with self.transaction():
+                            for product in self.iter_nist_products(response, page):
+                                page_count += 1
+                                processed_count += 1
+                                is_java, package_name, version = self.is_java_package(product)
+                                if is_java:
+                                    java_count += 1
+                                    logger.debug("Java package found (%d): %s, version: %s", java_count, package_name, version)
+
+                                    # Queue it to get vulnerability ranges once the page is read, it
+                                    # is stored once together with its ranges
+                                    osv_pairs.append((package_name, version))
+
+                            # Query OSV only after the body is fully read, so the NIST connection
+                            # never stalls on OSV requests. Large batches are chunked by OSV_BATCH_SIZE
+                            if osv_pairs:
+                                self.store_osv_ranges(osv_pairs, new_packages=True)
+                                osv_pairs = []
+
+                            # Committed with the page's packages, so a restart resumes right after it
+                            self.update_start_index_checkpoint(start_range, start_index + page_count)
+
+                    logger.info(f"Processed {processed_count} CPEs, found {java_count} Java packages")
+
+                    # Stop on the last page instead of requesting an empty one past it. Advancing by
+                    # the products actually received can't loop forever on a bad resultsPerPage
+                    start_index += page_count
+                    if not page_count or start_index >= page.get('totalResults', 0):
+                        # Update the last processed date after completing each chunk
+                        self.update_last_mod_end_date(end_range)
                         break
-                        
-                    # Process each package immediately
-                    for product in products:
-                        processed_count += 1
-                        is_java, package_name, version = self.is_java_package(product)
-                        if is_java:
-                            java_count += 1
-                            print(f"\nJava Package Found ({java_count}): {package_name}, Version: {version}")
-                            
-                            # Store package first
-                            self.store_vulnerability(package_name, version)
-                            
-                            # Then try to get vulnerability ranges
-                            ranges = self.try_get_osv_ranges(package_name, version)
-                            if ranges:
-                                print(f"\nOVS details found for package {package_name} {version}:")
-                                self.store_vulnerability(package_name, version, ranges)
-                    
-                    total_results = data.get('totalResults', 0)
-                    results_per_page = data.get('resultsPerPage', 0)
-                    
-                    logging.info(f"Processed {processed_count} CPEs, found {java_count} Java packages")
                     
-                    elapsed_time = time.time() - request_start_time
-                    sleep_time = max(self.sleep_time - elapsed_time, 0)
-                    time.sleep(sleep_time)
-                    
-                except requests.RequestException as e:
-                    logging.error(f"Error fetching NIST feed (startIndex={start_index}): {str(e)}")
+                except (requests.RequestException, ijson.JSONError) as e:
+                    logger.error(f"Error fetching NIST feed (startIndex={start_index}): {str(e)}")
                     if hasattr(e, 'response') and e.response:
-                        logging.error(f"Status code: {e.response.status_code}")
-                        logging.error(f"Response text: {e.response.text}")
+                        logger.error(f"Status code: {e.response.status_code}")
+                        logger.error(f"Response text: {e.response.text}")
                     return None
-                    
-                if total_results <= start_index + results_per_page:
-                    # Update the last processed date after completing each chunk
-                    self.update_last_mod_end_date(end_range)
-                    break
-                    
-                start_index += results_per_page
                 
-    def store_vulnerability(self, package_name: str, version: str, ranges: list = None):
-        """Store vulnerability information in the database"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # First, try to get existing record
-            cursor.execute('SELECT vulnerable_versions, osv_ranges FROM vulnerabilities WHERE package_name = ?',
-                         (package_name,))
-            result = cursor.fetchone()
-            
-            if result:
-                # Update existing record
-                versions = json.loads(result[0])
-                if version not in versions:
-                    versions.append(version)
-                
-                existing_ranges = json.loads(result[1]) if result[1] else []
-                # Add new ranges if they don't exist and ranges is not None
-                if ranges:
-                    for range_obj in ranges:
-                        if range_obj not in existing_ranges:
-                            existing_ranges.append(range_obj)
-                
-                cursor.execute('''
-                    UPDATE vulnerabilities 
-                    SET vulnerable_versions = ?, 
-                        osv_ranges = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE package_name = ?
-                ''', (json.dumps(versions), json.dumps(existing_ranges) if existing_ranges else None, package_name))
-            else:
-                # Insert new record
-                cursor.execute('''
-                    INSERT INTO vulnerabilities 
-                    (package_name, vulnerable_versions, osv_ranges)
-                    VALUES (?, ?, ?)
-                ''', (package_name, json.dumps([version]), json.dumps(ranges) if ranges else None))
-            
-            conn.commit()
+    def store_vulnerabilities(self, vulnerabilities: List[Tuple[str, str, Optional[list]]]):
+        """Store many (package_name, version, ranges) records in a single transaction.
+
+        Versions and ranges are rows of their own, so storing only inserts what is new and
+        never reads back and rewrites existing data. Each table is written with a single
+        executemany call, keeping the per-row loop out of Python.
+        """
+        with self.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO package (name) VALUES (?)
+                ON CONFLICT(name) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+            ''', [(package_name,) for package_name in dict.fromkeys(row[0] for row in vulnerabilities)])
+            conn.executemany('''
+                INSERT OR IGNORE INTO package_version (package_id, version)
+                SELECT id, ? FROM package WHERE name = ?
+            ''', [(version, package_name) for package_name, version, _ in vulnerabilities])
+            conn.executemany('''
+                INSERT OR IGNORE INTO osv_range (package_id, range_hash, range)
+                SELECT id, ?, ? FROM package WHERE name = ?
+            ''', [
+                (*self.canonical_range(range_obj), package_name)
+                for package_name, _, ranges in vulnerabilities
+                for range_obj in ranges or []
+            ])
 
     def update_database(self):
         """Update the vulnerability database with Java package vulnerabilities"""
-        current_time = datetime.strptime("2025-01-14T14:34:03+03:00", "%Y-%m-%dT%H:%M:%S%z")
-        current_time_str = current_time.strftime("%Y-%m-%dT%H:%M:%S.000+03:00")
+        current_time_str = datetime.now(self._tz).isoformat(timespec='milliseconds')
         
         # Get last update time
         last_update = self.get_last_mod_end_date()
         
         if last_update:
-            logging.info(f"Performing incremental update from {last_update} to {current_time_str}")
+            logger.info(f"Performing incremental update from {last_update} to {current_time_str}")
             feed_data = self.fetch_nist_feed()
         else:
-            logging.info("Performing initial data population")
+            logger.info("Performing initial data population")
             feed_data = self.fetch_nist_feed()
         
         if not feed_data:
             return
             
-        logging.info(f"Update completed. Processed {feed_data['total_processed']} CPEs, found {feed_data['java_packages']} Java packages")
+        logger.info(f"Update completed. Processed {feed_data['total_processed']} CPEs, found {feed_data['java_packages']} Java packages")
 
 def main():
-    tracker = VulnerabilityTracker()
-    tracker.update_database()
+    parser = argparse.ArgumentParser(description="Track vulnerabilities in Java packages using NIST NVD and OSV")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help=f"Ignore the {OSV_CACHE_TTL_DAYS}-day TTL of cached OSV responses and query OSV again")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log every Java package and OSV range found")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    tracker = VulnerabilityTracker(api_key=os.environ.get("NIST_API_KEY"), refresh_cache=args.refresh_cache)
+    try:
+        tracker.update_database()
+    finally:
+        tracker.close()
 
 if __name__ == "__main__":
     main()